@@ -4,6 +4,7 @@ Usage: python3 udstyle.py [OPTIONS] FILE...
   --parse=LANG          parse texts with Stanza; provide 2 letter language code
   --output=FILENAME     write result to a tab-separated file.
   --persentence         report per sentence results, not mean per document
+  --nocache             do not cache results in ~/.cache/udstyle
 Reported metrics:
   - LEN:  mean sentence length in words (excluding punctuation).
   - MDD:  mean dependency distance (Gibson, 1998).
@@ -14,7 +15,7 @@ Reported metrics:
   - CLS:  number of clauses per sentence.
   - CLL:  average clause length (clauses/words)
   - LXD:  lexical density: ratio of content words over total number of words
-  - POS/DEP tag frequencies (only with --output)
+  - POS_*, DEP_*: POS/DEP tag frequencies (only with --output)
 
 Example:
 $ python3 udstyle.py UD_Dutch-LassySmall/*.conllu
@@ -25,12 +26,35 @@ train.conllu  11.027  2.172  0.775  0.564  0.391  0.072  1.863  8.107  0.645
 """
 import os
 import sys
+import csv
 import getopt
+import pickle
+import struct
+import hashlib
+import tempfile
+import warnings
+import threading
 import subprocess
-from math import log, sqrt
-from contextlib import contextmanager
-from collections import Counter
+from queue import Queue, Full
+from functools import partial
+from contextlib import contextmanager, nullcontext, suppress
+from concurrent.futures import ProcessPoolExecutor
+from collections import namedtuple
+import numpy as np
 import pandas as pd
+try:
+	from numba import njit
+except ImportError:  # fall back to the NumPy implementation
+	njit = None
+pl = None
+if os.environ.get('UDSTYLE_POLARS'):  # use polars to write tables
+	try:
+		import polars as pl
+	except ImportError:  # fall back to pandas
+		pass
+# Issued by read_csv when the first line is a comment with extra fields.
+warnings.filterwarnings('ignore', 'Length of header or names does not match',
+		pd.errors.ParserWarning)
 # TODO: extract POS and syntactic n-grams frequencies
 # TODO: POS surprisal, requires training e.g. n-gram model on corpus
 
@@ -53,6 +77,118 @@ ID, FORM, LEMMA, UPOS, XPOS, FEATS, HEAD, DEPREL, DEPS, MISC = range(10)
 # DEPS: Enhanced dependency graph in the form of a list of head-deprel pairs.
 # MISC: Any other annotation.
 
+# Relations ignored in dependency distances; see complexitymetrics().
+EXCLUDE = frozenset({'fixed', 'flat', 'conj', 'punct'})
+# Content words, for lexical density.
+CONTENT = frozenset({'ADJ', 'ADV', 'INTJ', 'NOUN', 'PROPN', 'VERB'})
+
+# Universal POS tags and dependency relations; counttags() reports their
+# relative frequencies in this order.
+UPOSTAGS = [
+		'ADJ',  # adjective
+		'ADP',  # adposition
+		'ADV',  # adverb
+		'AUX',  # auxiliary
+		'CCONJ',  # coordinating conjunction
+		'DET',  # determiner
+		'INTJ',  # interjection
+		'NOUN',  # noun
+		'NUM',  # numeral
+		'PART',  # particle
+		'PRON',  # pronoun
+		'PROPN',  # proper noun
+		'PUNCT',  # punctuation
+		'SCONJ',  # subordinating conjunction
+		'SYM',  # symbol
+		'VERB',  # verb
+		'X',  # other
+		]
+DEPTAGS = [
+		'acl',  # clausal modifier of noun (adnominal clause)
+		'acl:relcl',  # relative clause modifier
+		'advcl',  # adverbial clause modifier
+		'advmod',  # adverbial modifier
+		'advmod:emph',  # emphasizing word, intensifier
+		'advmod:lmod',  # locative adverbial modifier
+		'amod',  # adjectival modifier
+		'appos',  # appositional modifier
+		'aux',  # auxiliary
+		'aux:pass',  # passive auxiliary
+		'case',  # case marking
+		'cc',  # coordinating conjunction
+		'cc:preconj',  # preconjunct
+		'ccomp',  # clausal complement
+		'clf',  # classifier
+		'compound',  # compound
+		'compound:lvc',  # light verb construction
+		'compound:prt',  # phrasal verb particle
+		'compound:redup',  # reduplicated compounds
+		'compound:svc',  # serial verb compounds
+		'conj',  # conjunct
+		'cop',  # copula
+		'csubj',  # clausal subject
+		'csubj:pass',  # clausal passive subject
+		'dep',  # unspecified dependency
+		'det',  # determiner
+		'det:numgov',  # pronominal quantifier governing the case of the noun
+		'det:nummod',  # pronominal quantifier agreeing in case with the noun
+		'det:poss',  # possessive determiner
+		'discourse',  # discourse element
+		'dislocated',  # dislocated elements
+		'expl',  # expletive
+		'expl:impers',  # impersonal expletive
+		'expl:pass',  # reflexive pronoun used in reflexive passive
+		'expl:pv',  # reflexive clitic with an inherently reflexive verb
+		'fixed',  # fixed multiword expression
+		'flat',  # flat multiword expression
+		'flat:foreign',  # foreign words
+		'flat:name',  # names
+		'goeswith',  # goes with
+		'iobj',  # indirect object
+		'list',  # list
+		'mark',  # marker
+		'nmod',  # nominal modifier
+		'nmod:poss',  # possessive nominal modifier
+		'nmod:tmod',  # temporal modifier
+		'nsubj',  # nominal subject
+		'nsubj:pass',  # passive nominal subject
+		'nummod',  # numeric modifier
+		'nummod:gov',  # numeric modifier governing the case of the noun
+		'obj',  # object
+		'obl',  # oblique nominal
+		'obl:agent',  # agent modifier
+		'obl:arg',  # oblique argument
+		'obl:lmod',  # locative modifier
+		'obl:tmod',  # temporal modifier
+		'orphan',  # orphan
+		'parataxis',  # parataxis
+		'punct',  # punctuation
+		'reparandum',  # overridden disfluency
+		'root',  # root
+		'vocative',  # vocative
+		'xcomp',  # open clausal complement
+		]
+# Tags are stored as small integer codes; unknown tags share the last code.
+UPOSCODES = {a: n for n, a in enumerate(UPOSTAGS)}
+DEPCODES = {a: n for n, a in enumerate(DEPTAGS)}
+# Boolean lookup tables indexed by tag code for EXCLUDE and CONTENT.
+EXCLUDELUT = np.zeros(len(DEPTAGS) + 1, dtype=np.bool_)
+EXCLUDELUT[[DEPCODES[a] for a in EXCLUDE]] = True
+CONTENTLUT = np.zeros(len(UPOSTAGS) + 1, dtype=np.bool_)
+CONTENTLUT[[UPOSCODES[a] for a in CONTENT]] = True
+
+# A corpus as flat arrays with one element per token; tags are int codes.
+# The tokens of sentence n are at offsets[n]:offsets[n + 1]; roots[n] is the
+# index of its root within the sentence.
+Corpus = namedtuple('Corpus', 'ids heads upos deprel offsets roots forms')
+
+# Directory where results of analyze() are cached.
+CACHEDIR = os.path.join(
+		os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+		'udstyle')
+# Part of the cache key; increment when the results of analyze() change.
+CACHEVERSION = 2
+
 
 def which(program, exception=True):
 	"""Return first match for program in search path.
@@ -109,265 +245,461 @@ def openread(filename, encoding='utf8'):
 
 def parsefiles(filenames, lang):
 	"""Parse UTF-8 encoded plain text files with Stanza if a corresponding
-	.conllu file does not exist already."""
-	nlp = None
+	.conllu file does not exist already. The texts are parsed as a batch."""
 	newfilenames = []
+	toparse = []
 	for filename in filenames:
 		conllu = '%s.conllu' % os.path.splitext(filename)[0]
 		newfilenames.append(conllu)
 		if (not os.path.exists(conllu)
 				or os.stat(conllu).st_mtime < os.stat(filename).st_mtime):
-			if nlp is None:
-				import stanza
-				from stanza.utils.conll import CoNLL
-				try:
-					nlp = stanza.Pipeline(lang)
-				except FileNotFoundError:
-					stanza.download(lang)
-					nlp = stanza.Pipeline(lang)
+			toparse.append((filename, conllu))
+	if toparse:
+		import stanza
+		from stanza.utils.conll import CoNLL
+		try:
+			nlp = stanza.Pipeline(lang)
+		except FileNotFoundError:
+			stanza.download(lang)
+			nlp = stanza.Pipeline(lang)
+		texts = []
+		for filename, _ in toparse:
 			with open(filename, encoding='utf8') as inp:
-				doc = nlp(inp.read())
+				texts.append(inp.read())
+		for (_, conllu), doc in zip(toparse, nlp.bulk_process(texts)):
 			# TODO: preserve paragraph breaks
 			CoNLL.write_doc2conll(doc, conllu)
 	return newfilenames
 
 
-def conllureader(filename, excludepunct=False):
-	"""Load corpus. Returns list of lists of lists:
-	sentences[sentno][tokenno][fieldno]"""
-	result = []
-	sent = []
-	with openread(filename) as inp:
-		for line in inp:
-			if line == '\n':
-				if sent:
-					try:
-						result.append(renumber(sent))
-					except KeyError:
-						pass
-					sent = []
-			elif line.startswith('#'):  # ignore all comments
-				pass
-			else:
-				fields = line[:-1].split('\t')
-				if '.' in fields[ID]:  # skip empty nodes
-					continue
-				elif excludepunct and fields[UPOS] == 'PUNCT':
-					continue
-				elif '-' in fields[ID]:  # multiword tokens
-					fields[ID] = int(fields[ID][:fields[ID].index('-')])
-				else:  # normal tokens
-					fields[ID] = int(fields[ID])
-				try:
-					fields[HEAD] = int(fields[HEAD])
-				except ValueError:
-					continue
-				sent.append(fields)
-	if not result:
+def conllureader(filename, excludepunct=False, forms=False, chunksize=100000):
+	"""Load corpus incrementally. Yields a Corpus of flat token arrays for
+	each block of consecutive sentences; only chunksize lines of the file
+	are processed at a time.
+
+	:param forms: if True, include word forms; otherwise, Corpus.forms is
+		None. Columns that are not used by the metrics are read as cheap
+		categoricals and then discarded."""
+	numsents = 0
+	rest = None  # tokens of a sentence that continues in the next chunk
+	# Plain files are memory mapped; others are read in binary mode, leaving
+	# the decoding to read_csv.
+	# An empty file cannot be memory mapped.
+	mmap = (isinstance(filename, str) and filename != '-'
+			and not filename.endswith(('.gz', '.zst', '.lz4'))
+			and os.path.getsize(filename) > 0)
+	with (nullcontext(filename) if mmap
+			else openread(filename, encoding=None)) as inp:
+		# Blank lines are kept as rows with an empty ID; they mark the end of
+		# each sentence. Quoting is disabled since FORM may contain quotes.
+		# All columns are read, since usecols fails on chunks consisting only
+		# of blank lines and comments. Comment lines may contain tabs and thus
+		# more than 10 fields; such lines are skipped, and index_col=False
+		# keeps pandas from taking extra fields on the first line as index.
+		try:
+			reader = pd.read_csv(
+					inp, sep='\t', header=None, names=range(10),
+					encoding='utf8', memory_map=mmap,
+					dtype={n: str if n == FORM and forms else 'category'
+						for n in range(10)},
+					quoting=csv.QUOTE_NONE, na_filter=False, index_col=False,
+					on_bad_lines='skip', skip_blank_lines=False, engine='c',
+					chunksize=chunksize)
+		except pd.errors.EmptyDataError:
+			reader = ()
+		for chunk in reader:
+			tokens = readtokens(chunk, excludepunct, forms)
+			if rest is not None:
+				tokens = {a: np.concatenate([rest[a], b])
+						for a, b in tokens.items()}
+			complete = tokens['sentno'] < (chunk[ID] == '').sum()
+			rest = {a: b[~complete] for a, b in tokens.items()}
+			rest['sentno'] = np.zeros_like(rest['sentno'])
+			corpus = makecorpus({a: b[complete] for a, b in tokens.items()})
+			if corpus is not None:
+				numsents += len(corpus.offsets) - 1
+				yield corpus
+	if rest is not None:  # last sentence not followed by a blank line
+		corpus = makecorpus(rest)
+		if corpus is not None:
+			numsents += len(corpus.offsets) - 1
+			yield corpus
+	if not numsents:
 		raise ValueError('no sentences; not a valid .conllu file?')
-	return result
 
 
-def renumber(sent):
-	"""Fix non-contiguous IDs because of multiword tokens or removed tokens"""
-	mapping = {line[ID]: n for n, line in enumerate(sent, 1)}
-	mapping[0] = 0
-	for line in sent:
-		line[ID] = mapping[line[ID]]
-		line[HEAD] = mapping[line[HEAD]]
-	return sent
-
-
-def mean(iterable):
-	"""Arithmetic mean."""
-	seq = list(iterable)  # accept generators
-	return sum(seq) / len(seq)
+def readtokens(df, excludepunct, forms=False):
+	"""Convert a chunk of lines to arrays with the tokens that are kept.
+
+	:returns: a dict of arrays; sentno is the number of blank lines in the
+		chunk that precede each token."""
+	sentno = (df[ID] == '').cumsum().to_numpy()
+	# Comments, empty nodes (decimal IDs) and multiword tokens (ID ranges
+	# without a HEAD) do not have an integer ID and get NaN.
+	ids, heads = catnumbers(df[ID]), catnumbers(df[HEAD])
+	keep = ~np.isnan(ids) & ~np.isnan(heads)
+	if excludepunct:
+		keep &= (df[UPOS] != 'PUNCT').to_numpy()
+	result = {'sentno': sentno[keep],
+			'ids': ids[keep].astype(np.int32),
+			'heads': heads[keep].astype(np.int32),
+			'upos': tagcodes(df[UPOS], UPOSCODES)[keep],
+			'deprel': tagcodes(df[DEPREL], DEPCODES)[keep]}
+	if forms:
+		result['forms'] = df[FORM].to_numpy()[keep]
+	return result
 
 
-def analyze(filename, excludepunct=True, persentence=False):
+def catnumbers(col):
+	"""Convert a categorical column of integers to an array of floats; values
+	that are not plain integers get NaN. Only distinct values are converted."""
+	cats = col.cat.categories
+	digits = np.asarray(cats.str.isdigit(), dtype=bool)
+	numbers = np.full(len(cats), np.nan)
+	numbers[digits] = cats[digits].astype(np.int64)
+	return numbers[col.cat.codes.to_numpy()]
+
+
+def makecorpus(tokens):
+	"""Renumber tokens and return a Corpus; None if no sentences remain."""
+	sentno = tokens['sentno']
+	if len(sentno) == 0:
+		return None
+	ids, heads, keep = renumber(sentno, tokens['ids'], tokens['heads'])
+	sentno, deprel = sentno[keep], tokens['deprel'][keep]
+	if len(sentno) == 0:
+		return None
+	offsets = np.append(
+			np.flatnonzero(np.diff(sentno, prepend=-1)), len(sentno))
+	# Find the first root of each sentence.
+	roots = np.append(np.flatnonzero(deprel == DEPCODES['root']), len(deprel))
+	roots = roots[np.searchsorted(roots, offsets[:-1])]
+	if (roots >= offsets[1:]).any():
+		raise ValueError('sentence without root')
+	return Corpus(
+			ids=ids, heads=heads,
+			upos=tokens['upos'][keep],
+			deprel=deprel,
+			offsets=offsets,
+			roots=roots - offsets[:-1],
+			forms=tokens['forms'][keep] if 'forms' in tokens else None)
+
+
+def renumber(sentno, ids, heads):
+	"""Fix non-contiguous IDs because of multiword tokens or removed tokens.
+
+	Sentences with a HEAD that refers to a removed token are dropped.
+	:param sentno: the sentence number of each token, in ascending order.
+	:returns: a tuple (ids, heads, keep) with the new IDs and HEADs of the
+		remaining tokens, and a boolean mask of the tokens that remain."""
+	starts = np.flatnonzero(np.diff(sentno, prepend=-1))
+	lens = np.diff(np.append(starts, len(sentno)))
+	first = np.repeat(starts, lens)  # index of first token in sentence
+	newids = np.arange(1, len(ids) + 1) - first
+	# Common case: a sentence without gaps in its IDs can be used as is; a
+	# token may only have been removed at the end of the sentence.
+	newheads = heads.copy()
+	valid = heads <= np.repeat(lens, lens)
+	gaps = np.repeat(np.logical_or.reduceat(ids != newids, starts), lens)
+	if gaps.any():
+		# For the sentences with gaps, the new ID of a HEAD is the position of
+		# the token with that ID among the remaining tokens of the sentence;
+		# look it up with a binary search.
+		idx = np.flatnonzero(gaps)
+		factor = int(max(ids[idx].max(), heads[idx].max())) + 1
+		keys = sentno[idx].astype(np.int64) * factor + ids[idx]
+		headkeys = sentno[idx].astype(np.int64) * factor + heads[idx]
+		order = (None if (np.diff(keys) > 0).all()
+				else np.argsort(keys, kind='stable'))
+		pos = np.searchsorted(keys, headkeys, sorter=order)
+		pos = np.minimum(pos, len(keys) - 1)
+		if order is not None:
+			pos = order[pos]
+		valid[idx] = (heads[idx] == 0) | (keys[pos] == headkeys)
+		newheads[idx] = np.where(heads[idx] == 0, 0, idx[pos] - first[idx] + 1)
+	keep = ~np.isin(sentno, sentno[~valid])
+	return (newids[keep].astype(np.int32), newheads[keep].astype(np.int32),
+			keep)
+
+
+def tagcodes(tags, codes):
+	"""Map a categorical series of tags to integer codes."""
+	mapping = np.array([codes.get(a, len(codes)) for a in tags.cat.categories],
+			dtype=np.uint8)
+	return mapping[tags.cat.codes.to_numpy()]
+
+
+def prefetch(iterable, maxsize=2):
+	"""Iterate over iterable in a background thread.
+
+	Up to maxsize items are produced ahead of the consumer. Exceptions raised
+	by iterable are re-raised in the consuming thread. When the consumer stops
+	early, the producer stops as well and closes iterable."""
+	queue = Queue(maxsize)
+	stop = threading.Event()
+	sentinel = object()
+
+	def put(item):
+		"""Put item in queue; return False if the consumer has stopped."""
+		while not stop.is_set():
+			try:
+				queue.put(item, timeout=0.1)
+				return True
+			except Full:
+				pass
+		return False
+
+	def producer():
+		try:
+			for item in iterable:
+				if not put((item, None)):
+					return
+			put((sentinel, None))
+		except Exception as err:  # re-raise in consumer
+			put((None, err))
+		finally:
+			if hasattr(iterable, 'close'):
+				iterable.close()
+
+	thread = threading.Thread(target=producer, daemon=True)
+	thread.start()
+	try:
+		while True:
+			item, err = queue.get()
+			if err is not None:
+				raise err
+			elif item is sentinel:
+				return
+			yield item
+	finally:
+		stop.set()
+		thread.join()
+
+
+def analyze(filename, excludepunct=True, persentence=False, cache=True,
+		wanttags=True):
 	"""Return a dict {featname: vector, ...} describing UD file.
-	Each feature vector has a value for each sentence."""
-	sentences = conllureader(filename, excludepunct=excludepunct)
-	result = complexitymetrics(sentences)
+	Each feature vector has a value for each sentence.
+
+	:param wanttags: if True, include POS and dependency tag frequencies
+		(not available with persentence=True).
+	:param cache: if True, the result is stored in CACHEDIR and reused as long
+		as the path, modification time and size of the file are the same.
+		Caching is best-effort: errors reading or writing the cache are
+		ignored."""
+	cachefile = None
+	if cache and isinstance(filename, str) and filename != '-':
+		stat = os.stat(filename)
+		key = hashlib.blake2b(
+				os.path.abspath(filename).encode('utf8')
+				+ struct.pack('<QQ', stat.st_mtime_ns, stat.st_size)
+				+ repr((CACHEVERSION, excludepunct, persentence, wanttags)
+					).encode('utf8'),
+				digest_size=16)
+		cachefile = os.path.join(CACHEDIR, '%s.pkl' % key.hexdigest())
+		try:
+			with open(cachefile, 'rb') as inp:
+				return pickle.load(inp)
+		except Exception:  # missing or corrupt cache file; recompute
+			pass
+	blocks, sents = [], []
+	postags = np.zeros(len(UPOSTAGS) + 1, dtype=np.int64)
+	deptags = np.zeros(len(DEPTAGS) + 1, dtype=np.int64)
+	corpora = conllureader(
+			filename, excludepunct=excludepunct, forms=persentence)
+	# Read and parse the next block of sentences in a background thread while
+	# the current block is processed; not worth it for tiny files.
+	if not (isinstance(filename, str) and os.path.isfile(filename)
+			and os.path.getsize(filename) < 1 << 20):
+		corpora = prefetch(corpora)
+	for corpus in corpora:
+		blocks.append(complexitymetrics(corpus))
+		if persentence:
+			sents.extend(' '.join(corpus.forms[a:b])
+					for a, b in zip(corpus.offsets[:-1], corpus.offsets[1:]))
+		elif wanttags:
+			postags += np.bincount(corpus.upos, minlength=len(postags))
+			deptags += np.bincount(corpus.deprel, minlength=len(deptags))
+	result = {a: np.concatenate([block[a] for block in blocks])
+			for a in blocks[0]}
 	if persentence:
-		result['sent'] = [' '.join(line[FORM] for line in sent)
-				for sent in sentences]
-		return result
-	# Get macro average over the per-sentence scores.
-	# Might want to look at standard deviation and other aspects of the
-	# distribution. TODO: offer micro average as well.
-	for a, b in result.items():
-		result[a] = sum(b) / len(b)
-	result.update(counttags(sentences))
+		result['sent'] = sents
+	else:
+		# Get macro average over the per-sentence scores.
+		# Might want to look at standard deviation and other aspects of the
+		# distribution. TODO: offer micro average as well.
+		for a, b in result.items():
+			result[a] = b.mean()
+		if wanttags:
+			result.update(counttags(postags, deptags))
+	if cachefile is not None:
+		# write to a temporary file first, in case of concurrent processes.
+		tmpname = None
+		try:
+			os.makedirs(CACHEDIR, exist_ok=True)
+			with tempfile.NamedTemporaryFile(
+					dir=CACHEDIR, delete=False) as out:
+				tmpname = out.name
+				pickle.dump(result, out)
+			os.replace(tmpname, cachefile)
+		except OSError:  # e.g., read-only file system; skip caching
+			if tmpname is not None:
+				with suppress(OSError):
+					os.remove(tmpname)
 	return result
 
 
-def complexitymetrics(sentences):
+def complexitymetrics(corpus):
 	"""Return dict of complexity metrics with results for each sentence."""
+	ids, heads = corpus.ids, corpus.heads
+	upos, deprel = corpus.upos, corpus.deprel
+	starts, lens = corpus.offsets[:-1], np.diff(corpus.offsets)
+	if njit is not None:
+		metrics, verbs = metricskernel(
+				ids, heads, deprel, upos, corpus.offsets, corpus.roots,
+				EXCLUDELUT, CONTENTLUT, DEPCODES['nmod'], UPOSCODES['VERB'])
+		return {'LEN': lens, 'MDD': metrics[0], 'NDD': metrics[1],
+				'ADJ': metrics[2], 'LEFT': metrics[3], 'MOD': metrics[4],
+				'CLS': 1 + verbs, 'CLL': metrics[5], 'LXD': metrics[6]}
+
+	def persent(values):
+		"""Sum values over the tokens of each sentence."""
+		return np.add.reduceat(values, starts, dtype=np.int64)
+
+	dist = np.abs(ids - heads)
 	result = {}
-	result['LEN'] = [len(sent) for sent in sentences]
+	result['LEN'] = lens
 	# Ignore certain relations, following Chen and Gerdes (2017, p. 57)
 	# http://www.aclweb.org/anthology/W17-6508
-	exclude = ('fixed', 'flat', 'conj', 'punct')
+	exclude = EXCLUDELUT[deprel]
 	# Gibson (1998) http://dx.doi.org/10.1016/S0010-0277(98)00034-1
 	# Liu (2008) https://hdl.handle.net/10371/70907
 	# mean dependency distance
-	result['MDD'] = [
-			mean(abs(line[ID] - line[HEAD]) for line in sent
-				if line[DEPREL] not in exclude)
-			for sent in sentences]
+	result['MDD'] = persent(np.where(exclude, 0, dist)) / persent(~exclude)
 	# Lei & Jockers (2018): https://doi.org/10.1080/09296174.2018.1504615
 	# normalized dependency distance
-	result['NDD'] = [
-		abs(log(mdd
-				/ sqrt(
-					([line[DEPREL] for line in sent].index('root') + 1)
-					* len(sent))))
-		for mdd, sent in zip(result['MDD'], sentences)]
+	result['NDD'] = np.abs(np.log(
+			result['MDD'] / np.sqrt((corpus.roots + 1) * lens)))
 	# proportion of adjacent dependencies
 	# https://doi.org/10.1016/j.langsci.2016.09.006
-	result['ADJ'] = [mean(abs(line[ID] - line[HEAD]) == 1 for line in sent)
-			for sent in sentences]
+	result['ADJ'] = persent(dist == 1) / lens
 	# dependency direction: proportion of left dependents
 	# http://www.aclweb.org/anthology/W17-6508
-	result['LEFT'] = [mean(line[ID] < line[HEAD] for line in sent)
-			for sent in sentences]
+	result['LEFT'] = persent(ids < heads) / lens
 	# nominal modifiers;
 	# attempt to measure phrasal complexity (as opposed to clausal complexity).
 	# see e.g. https://doi.org/10.1016/j.jeap.2010.01.001
-	result['MOD'] = [mean(line[DEPREL] == 'nmod' for line in sent)
-			for sent in sentences]
+	result['MOD'] = persent(deprel == DEPCODES['nmod']) / lens
+	verbs = persent(upos == UPOSCODES['VERB'])
 	# number of clauses per sentence; https://doi.org/10.1007/s11145-007-9107-5
-	result['CLS'] = [1 + sum(line[UPOS] == 'VERB' for line in sent)
-			for sent in sentences]
+	result['CLS'] = 1 + verbs
 	# avg clause len (clauses/words) https://aclanthology.org/2020.lrec-1.883
-	result['CLL'] = [
-			len(sent) / max(1, sum(line[UPOS] == 'VERB' for line in sent))
-			for sent in sentences]
+	result['CLL'] = lens / np.maximum(1, verbs)
 	# lexical density: ratio of content words over total number of words
 	# https://aclanthology.org/2020.lrec-1.883
-	content = ('ADJ', 'ADV', 'INTJ', 'NOUN', 'PROPN', 'VERB')
-	result['LXD'] = [sum(line[UPOS] in content for line in sent) / len(sent)
-			for sent in sentences]
+	result['LXD'] = persent(CONTENTLUT[upos]) / lens
 	return result
 
 
-def counttags(sentences):
-	"""Count POS and dependency tags; returns relative frequencies."""
-	numtokens = sum(len(sent) for sent in sentences)
-	postags = Counter(line[UPOS] for sent in sentences for line in sent)
-	deptags = Counter(line[DEPREL] for sent in sentences for line in sent)
-	tags = {a: postags[a] / numtokens for a in [
-			'ADJ',  # adjective
-			'ADP',  # adposition
-			'ADV',  # adverb
-			'AUX',  # auxiliary
-			'CCONJ',  # coordinating conjunction
-			'DET',  # determiner
-			'INTJ',  # interjection
-			'NOUN',  # noun
-			'NUM',  # numeral
-			'PART',  # particle
-			'PRON',  # pronoun
-			'PROPN',  # proper noun
-			'PUNCT',  # punctuation
-			'SCONJ',  # subordinating conjunction
-			'SYM',  # symbol
-			'VERB',  # verb
-			'X',  # other
-			]}
-	tags.update({a: deptags[a] / numtokens for a in [
-			'acl',  # clausal modifier of noun (adnominal clause)
-			'acl:relcl',  # relative clause modifier
-			'advcl',  # adverbial clause modifier
-			'advmod',  # adverbial modifier
-			'advmod:emph',  # emphasizing word, intensifier
-			'advmod:lmod',  # locative adverbial modifier
-			'amod',  # adjectival modifier
-			'appos',  # appositional modifier
-			'aux',  # auxiliary
-			'aux:pass',  # passive auxiliary
-			'case',  # case marking
-			'cc',  # coordinating conjunction
-			'cc:preconj',  # preconjunct
-			'ccomp',  # clausal complement
-			'clf',  # classifier
-			'compound',  # compound
-			'compound:lvc',  # light verb construction
-			'compound:prt',  # phrasal verb particle
-			'compound:redup',  # reduplicated compounds
-			'compound:svc',  # serial verb compounds
-			'conj',  # conjunct
-			'cop',  # copula
-			'csubj',  # clausal subject
-			'csubj:pass',  # clausal passive subject
-			'dep',  # unspecified dependency
-			'det',  # determiner
-			'det:numgov',  # pronominal quantifier governing the case of the noun
-			'det:nummod',  # pronominal quantifier agreeing in case with the noun
-			'det:poss',  # possessive determiner
-			'discourse',  # discourse element
-			'dislocated',  # dislocated elements
-			'expl',  # expletive
-			'expl:impers',  # impersonal expletive
-			'expl:pass',  # reflexive pronoun used in reflexive passive
-			'expl:pv',  # reflexive clitic with an inherently reflexive verb
-			'fixed',  # fixed multiword expression
-			'flat',  # flat multiword expression
-			'flat:foreign',  # foreign words
-			'flat:name',  # names
-			'goeswith',  # goes with
-			'iobj',  # indirect object
-			'list',  # list
-			'mark',  # marker
-			'nmod',  # nominal modifier
-			'nmod:poss',  # possessive nominal modifier
-			'nmod:tmod',  # temporal modifier
-			'nsubj',  # nominal subject
-			'nsubj:pass',  # passive nominal subject
-			'nummod',  # numeric modifier
-			'nummod:gov',  # numeric modifier governing the case of the noun
-			'obj',  # object
-			'obl',  # oblique nominal
-			'obl:agent',  # agent modifier
-			'obl:arg',  # oblique argument
-			'obl:lmod',  # locative modifier
-			'obl:tmod',  # temporal modifier
-			'orphan',  # orphan
-			'parataxis',  # parataxis
-			'punct',  # punctuation
-			'reparandum',  # overridden disfluency
-			'root',  # root
-			'vocative',  # vocative
-			'xcomp',  # open clausal complement
-			]})
+def metricskernel(ids, heads, deprel, upos, offsets, roots, excludelut,
+		contentlut, nmodcode, verbcode):
+	"""Compute the metrics of complexitymetrics() in a single loop over the
+	tokens; compiled with numba, if available.
+
+	:param excludelut, contentlut: boolean arrays indexed by tag code.
+	:returns: a tuple (metrics, verbs) where metrics is an array with rows
+		MDD, NDD, ADJ, LEFT, MOD, CLL, LXD; verbs is the number of verbs.
+		Each column corresponds to a sentence."""
+	nsents = len(offsets) - 1
+	metrics = np.empty((7, nsents))
+	verbs = np.zeros(nsents, dtype=np.int64)
+	for s in range(nsents):
+		start, end = offsets[s], offsets[s + 1]
+		sumdist = numdist = adj = left = nmod = numcontent = 0
+		for n in range(start, end):
+			dist = abs(ids[n] - heads[n])
+			if not excludelut[deprel[n]]:
+				sumdist += dist
+				numdist += 1
+			adj += dist == 1
+			left += ids[n] < heads[n]
+			nmod += deprel[n] == nmodcode
+			verbs[s] += upos[n] == verbcode
+			numcontent += contentlut[upos[n]]
+		length = end - start
+		mdd = sumdist / numdist
+		metrics[0, s] = mdd
+		metrics[1, s] = abs(np.log(mdd / np.sqrt((roots[s] + 1) * length)))
+		metrics[2, s] = adj / length
+		metrics[3, s] = left / length
+		metrics[4, s] = nmod / length
+		metrics[5, s] = length / max(1, verbs[s])
+		metrics[6, s] = numcontent / length
+	return metrics, verbs
+
+
+if njit is not None:
+	metricskernel = njit(cache=True, fastmath=True, nogil=True)(metricskernel)
+
+
+def counttags(postags, deptags):
+	"""Return relative frequencies of POS and dependency tags.
+
+	:param postags, deptags: arrays with the frequency of each tag code."""
+	numtokens = postags.sum()
+	# Prefix tags to distinguish them from metrics with the same name (ADJ).
+	tags = {'POS_' + a: b for a, b in zip(UPOSTAGS, postags / numtokens)}
+	tags.update(('DEP_' + a, b) for a, b in zip(DEPTAGS, deptags / numtokens))
 	return tags
 
 
-def compare(filenames, parse=None, excludepunct=True, persentence=False):
+def compare(filenames, parse=None, excludepunct=True, persentence=False,
+		cache=True, wanttags=True, polars=False):
 	"""Collect statistics for multiple files.
 	Returns a dataframe with one row per filename, with the mean score
-	for each metric in the colmuns."""
+	for each metric in the colmuns.
+
+	:param polars: if True, return a polars DataFrame with the filenames (or
+		row numbers) in an unnamed first column; otherwise, a pandas
+		DataFrame indexed by filename."""
 	if parse:
 		filenames = parsefiles(filenames, parse)
+	func = partial(analyze, excludepunct=excludepunct, persentence=persentence,
+			cache=cache, wanttags=wanttags)
+	# Files are independent; analyze regular files in parallel. Others, such
+	# as '-' for stdin, can only be read by this process.
+	parallel = [n for n, filename in enumerate(filenames)
+			if isinstance(filename, str) and os.path.isfile(filename)]
+	results = [None] * len(filenames)
+	if len(parallel) > 1:
+		with ProcessPoolExecutor() as executor:
+			for n, result in zip(parallel, executor.map(
+					func, [filenames[n] for n in parallel])):
+				results[n] = result
+	for n, filename in enumerate(filenames):
+		if results[n] is None:
+			results[n] = func(filename)
+	if polars:  # first column is unnamed, as the index written by pandas
+		if persentence:
+			return pl.concat([pl.DataFrame(result) for result in results]
+					).with_row_index('')
+		return pl.from_dicts([
+				{'': os.path.basename(filename), **result}
+				for filename, result in zip(filenames, results)])
 	if persentence:
-		return pd.concat([
-				pd.DataFrame(
-					analyze(filename, excludepunct=excludepunct,
-						persentence=persentence))
-				for filename in filenames],
+		return pd.concat([pd.DataFrame(result) for result in results],
 				ignore_index=True)
-	return pd.DataFrame({
-			os.path.basename(filename):
-				analyze(filename, excludepunct=excludepunct)
-			for filename in filenames}).T
+	return pd.DataFrame.from_dict({
+			os.path.basename(filename): result
+			for filename, result in zip(filenames, results)}, orient='index')
 
 
 def main():
 	"""CLI."""
 	try:
 		opts, args = getopt.gnu_getopt(
-				sys.argv[1:], '', ['output=', 'parse=', 'persentence'])
+				sys.argv[1:], '',
+				['output=', 'parse=', 'persentence', 'nocache'])
 		opts = dict(opts)
 	except getopt.GetoptError:
 		print(__doc__)
@@ -375,17 +707,23 @@ def main():
 	if not args:
 		print(__doc__)
 		return
+	polars = pl is not None and '--output' in opts
 	result = compare(
-			args, opts.get('--parse'), persentence='--persentence' in opts)
-	if '--persentence' in opts:
-		if '--output' in opts:
-			result.to_csv(opts.get('--output'), sep='\t')
+			args, opts.get('--parse'), persentence='--persentence' in opts,
+			cache='--nocache' not in opts, wanttags='--output' in opts,
+			polars=polars)
+	if '--output' in opts:
+		if polars:
+			# write header separately; polars would quote the empty name.
+			with open(opts.get('--output'), 'w', encoding='utf8') as out:
+				out.write('\t'.join(result.columns) + '\n')
+				result.write_csv(out, separator='\t', include_header=False)
 		else:
-			print(result)
-	elif '--output' in opts:
-		result.to_csv(opts.get('--output'), sep='\t')
+			result.to_csv(opts.get('--output'), sep='\t')
+	elif '--persentence' in opts:
+		print(result)
 	else:
-		print(result.iloc[:, :-79].round(3))  # skip tags
+		print(result.round(3))
 
 
 if __name__ == '__main__':